@@ -1,13 +1,48 @@
+import itertools
 import os
+import re
 import sys
-from fnmatch import fnmatch
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import translate
 from pathlib import Path
 
 import click
 from pathspec import PathSpec
 from pathspec.patterns import GitWildMatchPattern
 
-global_index = 1
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+# Reads are I/O bound and release the GIL, so a small pool keeps several
+# reads in flight. At most READ_WINDOW files are read ahead of the writer,
+# which bounds peak memory to that many files however large the tree is.
+READ_WORKERS = 8
+READ_WINDOW = 2 * READ_WORKERS
+
+# Compiled .gitignore specs keyed by absolute path and stored with the
+# (st_mtime_ns, st_size, st_ino) they were read at, so repeated runs in the
+# same process skip re-reading and re-parsing unchanged files. An edited or
+# replaced file replaces its own entry, and the least recently used entries
+# are evicted beyond GITIGNORE_CACHE_SIZE.
+GITIGNORE_CACHE_SIZE = 1024
+_GITIGNORE_CACHE = OrderedDict()
+
+# With more than this many --ignore patterns, compile them into a Hyperscan
+# database (when the optional dependency is installed) instead of a regex.
+HYPERSCAN_MIN_PATTERNS = 16
+
+# Bytes requested per read when streaming paths from stdin.
+STDIN_CHUNK_SIZE = 65536
+
+# Files with a NUL byte this close to the start are treated as binary and
+# skipped before the rest of the file is read.
+BINARY_SNIFF_SIZE = 8192
+
+BACKTICK_RUN_RE = re.compile("`{3,}")
 
 EXT_TO_LANG = {
     "py": "python",
@@ -28,56 +63,363 @@ EXT_TO_LANG = {
 
 
 def add_line_numbers(content):
-    lines = content.splitlines()
-    padding = len(str(len(lines)))
-    numbered_lines = [f"{i + 1:{padding}}  {line}" for i, line in enumerate(lines)]
+    if not content:
+        return ""
+    # Walk the content with find() rather than splitlines(), so the only
+    # intermediate copy is the list of numbered lines. A trailing newline
+    # does not start another line. Only "\n" separates lines: form feeds,
+    # U+2028 and the other separators splitlines() knows are kept as part
+    # of the line ("\r" is already normalised away when files are read).
+    end = len(content) - 1 if content.endswith("\n") else len(content)
+    line_count = content.count("\n", 0, end) + 1
+    padding = len(str(line_count))
+    numbered_lines = []
+    start = 0
+    for i in range(1, line_count + 1):
+        stop = content.find("\n", start, end)
+        if stop == -1:
+            stop = end
+        numbered_lines.append(f"{i:{padding}}  {content[start:stop]}")
+        start = stop + 1
     return "\n".join(numbered_lines)
 
 
-def print_path(writer, path, content, cxml, markdown, line_numbers):
-    normalized_path = Path(path).as_posix()
+def print_default(lines, path, content, index):
+    lines.append(path)
+    lines.append("---")
+    lines.append(content)
+    lines.append("")
+    lines.append("---")
+
+
+def print_as_xml(lines, path, content, index):
+    lines.append(f'<document index="{index}">')
+    lines.append(f"<source>{path}</source>")
+    lines.append("<document_content>")
+    lines.append(content)
+    lines.append("</document_content>")
+    lines.append("</document>")
+
+
+def print_as_markdown(lines, path, content, index):
+    lang = EXT_TO_LANG.get(path.split(".")[-1], "")
+    # The fence must be longer than any run of three or more backticks in
+    # the content; find the longest run in one pass
+    longest_run = max(
+        (len(run) for run in BACKTICK_RUN_RE.findall(content)), default=0
+    )
+    backticks = "`" * max(3, longest_run + 1)
+    lines.append(path)
+    lines.append(f"{backticks}{lang}")
+    lines.append(content)
+    lines.append(f"{backticks}")
+
+
+def _make_emitter(cxml, markdown, line_numbers, writer):
+    # Resolve the output options once and return a single
+    # emit(path, content, index) function, so nothing is re-checked per file
     if cxml:
-        print_as_xml(writer, normalized_path, content, line_numbers)
+        print_document = print_as_xml
     elif markdown:
-        print_as_markdown(writer, normalized_path, content, line_numbers)
+        print_document = print_as_markdown
     else:
-        print_default(writer, normalized_path, content, line_numbers)
-
+        print_document = print_default
 
-def print_default(writer, path, content, line_numbers):
-    writer(path)
-    writer("---")
+    # Each document is collected and handed to the writer in one call
     if line_numbers:
-        content = add_line_numbers(content)
-    writer(content)
-    writer("")
-    writer("---")
 
+        def emit(path, content, index):
+            lines = []
+            print_document(
+                lines, Path(path).as_posix(), add_line_numbers(content), index
+            )
+            lines.append("")
+            writer("\n".join(lines))
 
-def print_as_xml(writer, path, content, line_numbers):
-    global global_index
-    writer(f'<document index="{global_index}">')
-    writer(f"<source>{path}</source>")
-    writer("<document_content>")
-    if line_numbers:
-        content = add_line_numbers(content)
-    writer(content)
-    writer("</document_content>")
-    writer("</document>")
-    global_index += 1
+    else:
 
+        def emit(path, content, index):
+            lines = []
+            print_document(lines, Path(path).as_posix(), content, index)
+            lines.append("")
+            writer("\n".join(lines))
+
+    return emit
+
+
+class _BinaryFileError(Exception):
+    pass
+
+
+def _read_bytes(path):
+    # Unbuffered binary read into a buffer preallocated from st_size, so the
+    # bytes are copied once and decoded once. The first read only covers the
+    # sniff window, so binary files are rejected without reading them in full.
+    with open(path, "rb", buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        data = bytearray(size)
+        offset = 0
+        with memoryview(data) as view:
+            while offset < size:
+                stop = size if offset else min(size, BINARY_SNIFF_SIZE)
+                n = f.readinto(view[offset:stop])
+                if not n:
+                    break
+                if not offset and data.find(b"\0", 0, n) != -1:
+                    raise _BinaryFileError(path)
+                offset += n
+        del data[offset:]
+        # Files can grow after the fstat(), and some (e.g. in /proc) report
+        # a size of zero, so read on to EOF
+        data += f.read()
+    if not offset and data.find(b"\0", 0, BINARY_SNIFF_SIZE) != -1:
+        raise _BinaryFileError(path)
+    return data
+
+
+def _decode(data):
+    content = data.decode("utf-8")
+    if "\r" in content:
+        # Match the universal-newline translation of text-mode open()
+        content = content.replace("\r\n", "\n").replace("\r", "\n")
+    return content
+
+
+def _read_file(path):
+    # Returns (path, content, None), or (path, None, reason) for files that
+    # should be skipped with a warning
+    try:
+        return path, _decode(_read_bytes(path)), None
+    except _BinaryFileError:
+        return path, None, "binary content"
+    except UnicodeDecodeError:
+        return path, None, "UnicodeDecodeError"
+
+
+def _glob_to_regex(pattern):
+    # fnmatch.translate() emits atomic groups on newer Pythons, which
+    # Hyperscan does not support, so translate the glob syntax directly
+    i, n = 0, len(pattern)
+    res = []
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == "*":
+            res.append(".*")
+        elif c == "?":
+            res.append(".")
+        elif c == "[":
+            j = i
+            if j < n and pattern[j] == "!":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+            if j >= n:
+                res.append("\\[")
+            else:
+                chars = pattern[i:j].replace("\\", "\\\\")
+                i = j + 1
+                if chars[0] == "!":
+                    chars = "^" + chars[1:]
+                elif chars[0] == "^":
+                    chars = "\\" + chars
+                res.append(f"[{chars}]")
+        else:
+            res.append(re.escape(c))
+    return "^" + "".join(res) + "\\z"
+
+
+class _HyperscanMatcher:
+    """Match names against many --ignore globs with a single Hyperscan scan."""
+
+    def __init__(self, ignore_patterns, fallback):
+        expressions = [_glob_to_regex(p).encode("utf-8") for p in ignore_patterns]
+        # Globs such as "*" also match the empty string, which Hyperscan
+        # rejects unless explicitly allowed; names are never empty anyway
+        flags = (
+            hyperscan.HS_FLAG_DOTALL
+            | hyperscan.HS_FLAG_UTF8
+            | hyperscan.HS_FLAG_SINGLEMATCH
+            | hyperscan.HS_FLAG_ALLOWEMPTY
+        )
+        self._db = hyperscan.Database(mode=hyperscan.HS_MODE_BLOCK)
+        self._db.compile(
+            expressions=expressions,
+            ids=list(range(len(expressions))),
+            flags=[flags] * len(expressions),
+        )
+        self._fallback = fallback
+        # Scratch space may only be used by one scan at a time
+        self._local = threading.local()
 
-def print_as_markdown(writer, path, content, line_numbers):
-    lang = EXT_TO_LANG.get(path.split(".")[-1], "")
-    backticks = "```"
-    while backticks in content:
-        backticks += "`"
-    writer(path)
-    writer(f"{backticks}{lang}")
-    if line_numbers:
-        content = add_line_numbers(content)
-    writer(content)
-    writer(f"{backticks}")
+    def match(self, name):
+        try:
+            data = name.encode("utf-8")
+        except UnicodeEncodeError:
+            # Undecodable file names cannot be scanned in UTF-8 mode
+            return self._fallback.match(name)
+        scratch = getattr(self._local, "scratch", None)
+        if scratch is None:
+            scratch = self._local.scratch = hyperscan.Scratch(self._db)
+        matched = []
+        self._db.scan(
+            data,
+            match_event_handler=lambda *args: matched.append(True),
+            scratch=scratch,
+        )
+        return bool(matched)
+
+
+def _compile_ignore_patterns(ignore_patterns):
+    # Fold every --ignore glob into one regex so each name is tested with a
+    # single match() call. normcase() keeps fnmatch()'s case-insensitivity
+    # on Windows.
+    if not ignore_patterns:
+        return None
+    normalized = [os.path.normcase(p) for p in ignore_patterns]
+    ignore_re = re.compile("|".join(translate(p) for p in normalized))
+    if hyperscan is not None and len(normalized) > HYPERSCAN_MIN_PATTERNS:
+        try:
+            return _HyperscanMatcher(normalized, ignore_re)
+        except hyperscan.error:
+            pass
+    return ignore_re
+
+
+def _load_gitignore(gitignore_file):
+    # Relative paths would collide across working directories
+    key = os.path.abspath(gitignore_file)
+    st = os.stat(gitignore_file)
+    signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+    cached = _GITIGNORE_CACHE.get(key)
+    if cached is not None and cached[0] == signature:
+        _GITIGNORE_CACHE.move_to_end(key)
+        return cached[1]
+    try:
+        with open(gitignore_file, "r", encoding="utf-8") as f:
+            lines = [line.strip() for line in f]
+    except UnicodeDecodeError:
+        warning_message = f"Warning: Skipping .gitignore file {gitignore_file} due to UnicodeDecodeError"
+        click.echo(click.style(warning_message, fg="red"), err=True)
+        return None
+    patterns = [line for line in lines if line and not line.startswith("#")]
+    spec = PathSpec.from_lines(GitWildMatchPattern, patterns) if patterns else None
+    _GITIGNORE_CACHE[key] = (signature, spec)
+    _GITIGNORE_CACHE.move_to_end(key)
+    if len(_GITIGNORE_CACHE) > GITIGNORE_CACHE_SIZE:
+        _GITIGNORE_CACHE.popitem(last=False)
+    return spec
+
+
+def _is_gitignored(gitignore_stack, rel_path):
+    # Like git, the closest .gitignore with a matching rule decides; within a
+    # file the last matching rule wins, which check_file() already handles.
+    for prefix, spec in reversed(gitignore_stack):
+        include = spec.check_file(rel_path[len(prefix):]).include
+        if include is not None:
+            return include
+    return False
+
+
+def _has_extension(name, extensions):
+    # extensions is a set without leading dots. Check each dotted suffix,
+    # shortest first, so multi-part extensions like "tar.gz" also match.
+    dot = name.rfind(".")
+    while dot != -1:
+        if name[dot + 1 :] in extensions:
+            return True
+        dot = name.rfind(".", 0, dot)
+    return False
+
+
+def _iter_files(
+    dirpath,
+    prefix,
+    gitignore_stack,
+    include_hidden,
+    ignore_files_only,
+    ignore_re,
+    extensions,
+):
+    """
+    Yield the paths of files under dirpath that survive every filter.
+
+    prefix is dirpath relative to the walk root as a POSIX path ending in
+    "/" (or "" for the root itself). gitignore_stack is a tuple of
+    (prefix, spec) pairs for each .gitignore between the root and dirpath,
+    outermost first, or None when .gitignore files are not honoured.
+    """
+    try:
+        with os.scandir(dirpath) as it:
+            entries = list(it)
+    except OSError:
+        # Unreadable directories are skipped, as os.walk() does
+        return
+
+    if gitignore_stack is not None:
+        for entry in entries:
+            if entry.name == ".gitignore" and entry.is_file():
+                spec = _load_gitignore(entry.path)
+                if spec is not None:
+                    gitignore_stack += ((prefix, spec),)
+                break
+
+    subdirs = []
+    for entry in entries:
+        name = entry.name
+        # Filter hidden files and directories first
+        if not include_hidden and name[0] == ".":
+            continue
+        # DirEntry caches its type from the directory listing, so this does
+        # not need another stat() except for symlinks
+        is_dir = entry.is_dir()
+        # Filter based on --ignore patterns
+        if ignore_re and (not is_dir or not ignore_files_only):
+            if ignore_re.match(os.path.normcase(name)):
+                continue
+        if is_dir:
+            # Like os.walk(), never descend into symlinked directories
+            if entry.is_symlink():
+                continue
+            rel_path = f"{prefix}{name}/"
+        else:
+            if extensions and not _has_extension(name, extensions):
+                continue
+            rel_path = f"{prefix}{name}"
+        if gitignore_stack and _is_gitignored(gitignore_stack, rel_path):
+            continue
+        if is_dir:
+            subdirs.append((entry.path, rel_path))
+        else:
+            yield entry.path
+
+    for subdir, subprefix in subdirs:
+        yield from _iter_files(
+            subdir,
+            subprefix,
+            gitignore_stack,
+            include_hidden,
+            ignore_files_only,
+            ignore_re,
+            extensions,
+        )
+
+
+def _read_files(paths):
+    # Results come back in submission order, so output stays sorted while the
+    # reads overlap. Only READ_WINDOW files are in flight or waiting to be
+    # emitted at once, so memory is bounded by that many files rather than
+    # by the size of the whole tree.
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+        pending = deque()
+        for path in paths:
+            if len(pending) >= READ_WINDOW:
+                yield pending.popleft().result()
+            pending.append(executor.submit(_read_file, path))
+        while pending:
+            yield pending.popleft().result()
 
 
 def process_path(
@@ -87,103 +429,69 @@ def process_path(
     ignore_files_only,
     ignore_gitignore,
     ignore_patterns,
-    writer,
-    claude_xml,
-    markdown,
-    line_numbers=False,
+    emit,
+    index=1,
 ):
+    """
+    Print every selected file under path, numbering documents from index.
+
+    Returns the index for the next document, so callers can number the
+    output of several paths consecutively.
+    """
     if os.path.isfile(path):
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                print_path(writer, path, f.read(), claude_xml, markdown, line_numbers)
-        except UnicodeDecodeError:
-            warning_message = f"Warning: Skipping file {path} due to UnicodeDecodeError"
+        _, content, reason = _read_file(path)
+        if content is None:
+            warning_message = f"Warning: Skipping file {path} due to {reason}"
             click.echo(click.style(warning_message, fg="red"), err=True)
-        return
-
-    base_path = Path(path)
-    
-    # FIX: Initialize all_patterns before the conditional block
-    all_patterns = []
-    if not ignore_gitignore:
-        for root, _, _ in os.walk(base_path):
-            gitignore_file = Path(root) / ".gitignore"
-            if gitignore_file.is_file():
-                try:
-                    with open(gitignore_file, "r", encoding="utf-8") as f:
-                        # Get path of .gitignore relative to the base_path
-                        relative_dir = gitignore_file.parent.relative_to(base_path)
-                        for line in f:
-                            line = line.strip()
-                            if line and not line.startswith("#"):
-                                # Prepend the relative directory to the pattern
-                                # This makes patterns like `/foo` work correctly
-                                if str(relative_dir) == ".":
-                                    all_patterns.append(line)
-                                else:
-                                    all_patterns.append(f"{relative_dir.as_posix()}/{line}")
-
-                except UnicodeDecodeError:
-                    warning_message = f"Warning: Skipping .gitignore file {gitignore_file} due to UnicodeDecodeError"
-                    click.echo(click.style(warning_message, fg="red"), err=True)
-
-    # Create a single spec from all collected patterns
-    gitignore_spec = PathSpec.from_lines(GitWildMatchPattern, all_patterns)
-
-    files_to_process = []
-    for root, dirs, files in os.walk(path, topdown=True):
-        # Filter hidden files and directories first
-        if not include_hidden:
-            dirs[:] = [d for d in dirs if not d.startswith(".")]
-            files = [f for f in files if not f.startswith(".")]
-        
-        # Filter based on --ignore patterns
-        if ignore_patterns:
-            if not ignore_files_only:
-                dirs[:] = [d for d in dirs if not any(fnmatch(d, p) for p in ignore_patterns)]
-            files = [f for f in files if not any(fnmatch(f, p) for p in ignore_patterns)]
-        
-        # Combine dirs and files for gitignore checking
-        paths_to_check = [Path(root).relative_to(base_path) / item for item in dirs + files]
-        
-        # Filter based on the comprehensive .gitignore spec
-        ignored_paths = set(gitignore_spec.match_files(paths_to_check))
-        
-        dirs[:] = [d for d in dirs if Path(root).relative_to(base_path) / d not in ignored_paths]
-        files = [f for f in files if Path(root).relative_to(base_path) / f not in ignored_paths]
-
-        # Filter based on extensions
-        if extensions:
-            files = [f for f in files if f.endswith(extensions)]
-
-        for file in files:
-            files_to_process.append(os.path.join(root, file))
-
-    for file_path in sorted(files_to_process):
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                print_path(
-                    writer,
-                    file_path,
-                    f.read(),
-                    claude_xml,
-                    markdown,
-                    line_numbers,
-                )
-        except UnicodeDecodeError:
-            warning_message = f"Warning: Skipping file {file_path} due to UnicodeDecodeError"
+            return index
+        emit(path, content, index)
+        return index + 1
+
+    files_to_process = _iter_files(
+        path,
+        "",
+        None if ignore_gitignore else (),
+        include_hidden,
+        ignore_files_only,
+        _compile_ignore_patterns(ignore_patterns),
+        extensions,
+    )
+
+    for file_path, content, reason in _read_files(sorted(files_to_process)):
+        if content is None:
+            warning_message = f"Warning: Skipping file {file_path} due to {reason}"
             click.echo(click.style(warning_message, fg="red"), err=True)
+            continue
+        emit(file_path, content, index)
+        index += 1
+    return index
 
 
 def read_paths_from_stdin(use_null_separator):
+    # Yield paths as they arrive rather than reading all of stdin first, so
+    # memory stays bounded and processing overlaps with the producer
     if sys.stdin.isatty():
-        return []
-    stdin_content = sys.stdin.read()
-    if use_null_separator:
-        paths = stdin_content.split("\0")
-    else:
-        paths = stdin_content.split()
-    return [p for p in paths if p]
+        return
+    stream = sys.stdin.buffer
+    read = getattr(stream, "read1", stream.read)
+    remainder = b""
+    while True:
+        chunk = read(STDIN_CHUNK_SIZE)
+        if not chunk:
+            break
+        data = remainder + chunk
+        if use_null_separator:
+            paths = data.split(b"\0")
+            remainder = paths.pop()
+        else:
+            paths = data.split()
+            # A path may continue in the next chunk
+            remainder = b"" if data[-1:].isspace() or not paths else paths.pop()
+        for p in paths:
+            if p:
+                yield p.decode("utf-8")
+    if remainder:
+        yield remainder.decode("utf-8")
 
 
 @click.command()
@@ -260,41 +568,38 @@ def cli(
     null,
 ):
     """Docstring unchanged"""
-    global global_index
-    global_index = 1
-
-    if not sys.stdin.isatty():
-        sys.stdin.reconfigure(encoding='utf-8')
 
     stdin_paths = read_paths_from_stdin(use_null_separator=null)
-    all_paths = [*paths, *stdin_paths]
+    all_paths = itertools.chain(paths, stdin_paths)
 
-    writer = click.echo
     fp = None
     if output_file:
         fp = open(output_file, "w", encoding="utf-8")
-        writer = lambda s: print(s, file=fp)
+    writer = fp.write if fp else sys.stdout.write
+    emit = _make_emitter(claude_xml, markdown, line_numbers, writer)
 
     if claude_xml:
-        writer("<documents>")
+        writer("<documents>\n")
+
+    # Accept both "-e py" and "-e .py"
+    extensions = frozenset(e.lstrip(".") for e in extensions) or None
 
+    index = 1
     for path in all_paths:
         if not os.path.exists(path):
             raise click.BadArgumentUsage(f"Path does not exist: {path}")
-        process_path(
+        index = process_path(
             path,
             extensions,
             include_hidden,
             ignore_files_only,
             ignore_gitignore,
             ignore_patterns,
-            writer,
-            claude_xml,
-            markdown,
-            line_numbers,
+            emit,
+            index,
         )
 
     if claude_xml:
-        writer("</documents>")
+        writer("</documents>\n")
     if fp:
         fp.close()
\ No newline at end of file
@@ -7,9 +7,18 @@ from pathlib import Path
 
 from click.testing import CliRunner
 
+from files_to_prompt import cli as cli_module
 from files_to_prompt.cli import cli
 
 
+@pytest.fixture(autouse=True)
+def clear_gitignore_cache():
+    # Keep tests from sharing compiled .gitignore specs through module state
+    cli_module._GITIGNORE_CACHE.clear()
+    yield
+    cli_module._GITIGNORE_CACHE.clear()
+
+
 def filenames_from_cxml(cxml_string):
     "Return set of filenames from <source>...</source> tags"
     # Normalize paths to use forward slashes for comparison
@@ -148,6 +157,107 @@ def test_ignore_gitignore(tmpdir):
         }
 
 
+def test_nested_gitignore_scoping(tmpdir):
+    runner = CliRunner()
+    with tmpdir.as_cwd():
+        os.makedirs("project/sub/deeper")
+        os.makedirs("project/other")
+        with open("project/sub/.gitignore", "w", encoding="utf-8") as f:
+            f.write("/local.txt\n*.log\n")
+        for name in (
+            "project/local.txt",
+            "project/root.log",
+            "project/sub/local.txt",
+            "project/sub/deeper/local.txt",
+            "project/sub/deeper/debug.log",
+            "project/other/debug.log",
+        ):
+            with open(name, "w", encoding="utf-8") as f:
+                f.write(name)
+
+        result = runner.invoke(cli, ["project", "-c"])
+        assert result.exit_code == 0, result.output
+        assert filenames_from_cxml(result.output) == {
+            "project/local.txt",
+            "project/root.log",
+            "project/sub/deeper/local.txt",
+            "project/other/debug.log",
+        }
+
+
+def test_gitignore_changes_between_runs(tmpdir):
+    runner = CliRunner()
+    with tmpdir.as_cwd():
+        os.makedirs("test_dir")
+        with open("test_dir/.gitignore", "w", encoding="utf-8") as f:
+            f.write("one.txt\n")
+        with open("test_dir/one.txt", "w", encoding="utf-8") as f:
+            f.write("one")
+        with open("test_dir/two.txt", "w", encoding="utf-8") as f:
+            f.write("two")
+
+        result = runner.invoke(cli, ["test_dir", "-c"])
+        assert result.exit_code == 0
+        assert filenames_from_cxml(result.output) == {"test_dir/two.txt"}
+
+        with open("test_dir/.gitignore", "w", encoding="utf-8") as f:
+            f.write("two.txt\n")
+        # Make sure the mtime changes even on coarse-grained filesystems
+        stat = os.stat("test_dir/.gitignore")
+        os.utime(
+            "test_dir/.gitignore",
+            ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000),
+        )
+
+        result = runner.invoke(cli, ["test_dir", "-c"])
+        assert result.exit_code == 0
+        assert filenames_from_cxml(result.output) == {"test_dir/one.txt"}
+
+        # The edited file replaced its cache entry instead of adding one
+        assert list(cli_module._GITIGNORE_CACHE) == [
+            os.path.abspath(os.path.join("test_dir", ".gitignore"))
+        ]
+
+
+def test_gitignore_cache_is_bounded(tmpdir, monkeypatch):
+    monkeypatch.setattr(cli_module, "GITIGNORE_CACHE_SIZE", 2)
+    with tmpdir.as_cwd():
+        for name in ("a", "b", "c"):
+            os.makedirs(name)
+            with open(f"{name}/.gitignore", "w", encoding="utf-8") as f:
+                f.write("*.log\n")
+            cli_module._load_gitignore(f"{name}/.gitignore")
+        assert list(cli_module._GITIGNORE_CACHE) == [
+            os.path.abspath("b/.gitignore"),
+            os.path.abspath("c/.gitignore"),
+        ]
+
+
+def test_gitignore_cache_across_working_directories(tmpdir):
+    # Two trees with the same relative layout and identical .gitignore
+    # mtimes must not share a cached spec
+    runner = CliRunner()
+    for tree, ignored in (("a", "one.txt"), ("b", "two.txt")):
+        os.makedirs(tmpdir / tree / "test_dir")
+        with open(tmpdir / tree / "test_dir" / ".gitignore", "w") as f:
+            f.write(f"{ignored}\n")
+        for name in ("one.txt", "two.txt"):
+            with open(tmpdir / tree / "test_dir" / name, "w") as f:
+                f.write(name)
+    mtime_ns = os.stat(tmpdir / "a" / "test_dir" / ".gitignore").st_mtime_ns
+    for tree in ("a", "b"):
+        os.utime(tmpdir / tree / "test_dir" / ".gitignore", ns=(mtime_ns, mtime_ns))
+
+    with (tmpdir / "a").as_cwd():
+        result = runner.invoke(cli, ["test_dir", "-c"])
+        assert result.exit_code == 0
+        assert filenames_from_cxml(result.output) == {"test_dir/two.txt"}
+    with (tmpdir / "b").as_cwd():
+        result = runner.invoke(cli, ["test_dir", "-c"])
+        assert result.exit_code == 0
+        assert filenames_from_cxml(result.output) == {"test_dir/one.txt"}
+
+
 def test_multiple_paths(tmpdir):
     runner = CliRunner()
     with tmpdir.as_cwd():
@@ -207,6 +317,46 @@ def test_ignore_patterns(tmpdir):
         result = runner.invoke(cli, ["test_dir", "--ignore", ""])
 
 
+def test_many_ignore_patterns(tmpdir):
+    # Enough patterns to use the Hyperscan matcher when it is installed
+    runner = CliRunner()
+    with tmpdir.as_cwd():
+        os.makedirs("test_dir/build_output")
+        for name in ("keep.py", "skip.log", "skip.tmp", "a1.txt", "ab.txt"):
+            with open(f"test_dir/{name}", "w") as f:
+                f.write(name)
+        with open("test_dir/build_output/inner.py", "w") as f:
+            f.write("inner")
+
+        patterns = ["*.log", "*.tmp", "a[0-9].txt", "build*"] + [
+            f"unused{i}*" for i in range(20)
+        ]
+        args = ["test_dir", "-c"]
+        for pattern in patterns:
+            args.extend(["--ignore", pattern])
+        result = runner.invoke(cli, args)
+        assert result.exit_code == 0
+        assert filenames_from_cxml(result.output) == {
+            "test_dir/keep.py",
+            "test_dir/ab.txt",
+        }
+
+
+def test_hyperscan_matcher_accepts_patterns_matching_empty_names():
+    pytest.importorskip("hyperscan")
+    from fnmatch import fnmatch
+    from files_to_prompt.cli import _HyperscanMatcher, _compile_ignore_patterns
+
+    patterns = ["*", "", "*.log", "a?[!x]", "[]]*"]
+    patterns += [f"unused{i}*" for i in range(20)]
+    matcher = _compile_ignore_patterns(patterns[1:])
+    assert isinstance(matcher, _HyperscanMatcher)
+    for name in ("debug.log", "abc", "abx", "]x", "keep.py"):
+        expected = any(fnmatch(name, p) for p in patterns[1:])
+        assert bool(matcher.match(name)) == expected
+    assert isinstance(_compile_ignore_patterns(patterns), _HyperscanMatcher)
+
+
 def test_specific_extensions(tmpdir):
     runner = CliRunner()
     with tmpdir.as_cwd():
@@ -231,6 +381,19 @@ def test_specific_extensions(tmpdir):
         assert "test_dir/two/two.py" in result.output
         assert "test_dir/three.md" in result.output
 
+        # Leading dots are optional and names merely ending in the
+        # extension do not match
+        with open("test_dir/happy", "w") as f:
+            f.write("This is happy")
+        with open("test_dir/archive.tar.gz", "w") as f:
+            f.write("This is archive.tar.gz")
+        result = runner.invoke(cli, ["test_dir", "-e", ".py", "-e", "tar.gz"])
+        assert result.exit_code == 0
+        assert "test_dir/one.py" in result.output
+        assert "test_dir/archive.tar.gz" in result.output
+        assert "test_dir/happy" not in result.output
+        assert "test_dir/three.md" not in result.output
+
 
 def test_mixed_paths_with_options(tmpdir):
     runner = CliRunner()
@@ -291,6 +454,21 @@ def test_mixed_paths_with_options(tmpdir):
         assert "Contents of single file" in result.output
 
 
+def test_read_window_bounds_files_in_memory(monkeypatch):
+    started = []
+    monkeypatch.setattr(cli_module, "READ_WINDOW", 4)
+    monkeypatch.setattr(
+        cli_module, "_read_file", lambda path: started.append(path) or (path, "", None)
+    )
+
+    paths = [f"file{i}" for i in range(50)]
+    for consumed, (path, _, _) in enumerate(cli_module._read_files(paths)):
+        assert path == paths[consumed]
+        # Reads may only run ahead of the consumer by the window size
+        assert len(started) - consumed <= 4
+    assert sorted(started) == sorted(paths)
+
+
 def test_binary_file_warning(tmpdir):
     runner = CliRunner()
     with tmpdir.as_cwd():
@@ -315,6 +493,26 @@ def test_binary_file_warning(tmpdir):
         )
 
 
+def test_binary_file_with_nul_bytes(tmpdir):
+    runner = CliRunner()
+    with tmpdir.as_cwd():
+        os.makedirs("test_dir")
+        # Valid UTF-8, but the NUL byte marks it as binary
+        with open("test_dir/image.bin", "wb") as f:
+            f.write(b"PNG\x00" + b"a" * 20000)
+        with open("test_dir/text_file.txt", "w", encoding="utf-8") as f:
+            f.write("This is a text file")
+
+        result = runner.invoke(cli, ["test_dir"])
+        assert result.exit_code == 0
+        assert "This is a text file" in result.stdout
+        assert "image.bin" not in result.stdout
+        assert (
+            f"Warning: Skipping file {os.path.join('test_dir', 'image.bin')} due to binary content"
+            in result.stderr
+        )
+
+
 @pytest.mark.parametrize(
     "args", (["test_dir"], ["test_dir/file1.txt", "test_dir/file2.txt"])
 )
@@ -348,6 +546,19 @@ Contents of file2.txt
         assert expected.strip() == actual.strip()
 
 
+def test_ansi_escapes_pass_through_to_stdout(tmpdir):
+    # File content is written verbatim, even when stdout is not a terminal
+    runner = CliRunner()
+    with tmpdir.as_cwd():
+        os.makedirs("test_dir")
+        content = "\033[31mred text here\033[0m"
+        with open("test_dir/colors.txt", "w") as f:
+            f.write(content)
+        result = runner.invoke(cli, ["test_dir"])
+        assert result.exit_code == 0
+        assert content in result.stdout
+
+
 @pytest.mark.parametrize("arg", ("-o", "--output"))
 def test_output_option(tmpdir, arg):
     runner = CliRunner()
@@ -408,6 +619,26 @@ def test_line_numbers(tmpdir):
         assert "4  Fourth line" in result.output
 
 
+@pytest.mark.parametrize(
+    "content,expected",
+    (
+        ("", ""),
+        ("\n", "1  "),
+        ("one\ntwo", "1  one\n2  two"),
+        ("one\ntwo\n", "1  one\n2  two"),
+        ("one\n\n", "1  one\n2  "),
+        (
+            "".join(f"line {i}\n" for i in range(1, 11)),
+            "\n".join(f"{i:2}  line {i}" for i in range(1, 11)),
+        ),
+        # Only "\n" starts a new line; other separators stay in the line
+        ("page\fbreak\u2028same\nnext", "1  page\fbreak\u2028same\n2  next"),
+    ),
+)
+def test_add_line_numbers(content, expected):
+    assert cli_module.add_line_numbers(content) == expected
+
+
 @pytest.mark.parametrize(
     "input,extra_args",
     (
@@ -437,6 +668,35 @@ def test_reading_paths_from_stdin(tmpdir, input, extra_args):
         assert "Contents of file2" in result.output
 
 
+@pytest.mark.parametrize(
+    "input,extra_args",
+    (
+        ("test_dir1/file1.txt \n\t tést_dir2/file2.txt\n", []),
+        ("test_dir1/file1.txt\0tést_dir2/file2.txt\0", ["-0"]),
+        ("test_dir1/file1.txt\0\0tést_dir2/file2.txt", ["--null"]),
+    ),
+)
+def test_reading_paths_from_stdin_in_small_chunks(tmpdir, monkeypatch, input, extra_args):
+    # Force every path, including the multi-byte character, to be split
+    # across several reads
+    monkeypatch.setattr(cli_module, "STDIN_CHUNK_SIZE", 3)
+    runner = CliRunner()
+    with tmpdir.as_cwd():
+        os.makedirs("test_dir1")
+        os.makedirs("tést_dir2")
+        with open("test_dir1/file1.txt", "w") as f:
+            f.write("Contents of file1")
+        with open("tést_dir2/file2.txt", "w") as f:
+            f.write("Contents of file2")
+
+        result = runner.invoke(cli, args=extra_args + ["-c"], input=input)
+        assert result.exit_code == 0, result.output
+        assert filenames_from_cxml(result.output) == {
+            "test_dir1/file1.txt",
+            "tést_dir2/file2.txt",
+        }
+
+
 def test_paths_from_arguments_and_stdin(tmpdir):
     runner = CliRunner()
     with tmpdir.as_cwd():
@@ -496,3 +756,24 @@ def test_markdown(tmpdir, option):
             "`````\n"
         )
         assert expected.strip() == actual.strip()
+
+
+def test_markdown_fence_longer_than_longest_backtick_run(tmpdir):
+    runner = CliRunner()
+    with tmpdir.as_cwd():
+        os.makedirs("test_dir")
+        # The longest run is neither the first nor the last one
+        content = "a ``` b ````` c ```` d"
+        with open("test_dir/runs.py", "w") as f:
+            f.write(content)
+        result = runner.invoke(cli, ["test_dir", "-m"])
+        assert result.exit_code == 0
+
+        # Same answer as growing the fence until it no longer occurs
+        backticks = "```"
+        while backticks in content:
+            backticks += "`"
+        assert backticks == "`" * 6
+        assert result.output == (
+            f"test_dir/runs.py\n{backticks}python\n{content}\n{backticks}\n"
+        )